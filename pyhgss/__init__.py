@@ -1,4 +1,5 @@
 #!usr/bin/env python3
+import ast
 import logging
 import sys
 from hashlib import sha1
@@ -14,15 +15,22 @@ if __name__ == "__init__":
     from cli import cli
     from environment import ScriptExited as _ScriptExited
     from environment import make_environment
-    from util import guess_encoding
+    from dependencies import imported_files, changed_files
+    from optimize import optimize_constant_writes
+    from util import guess_encoding, stat_signature
 else:
     from .cli import cli
     from .environment import ScriptExited as _ScriptExited
     from .environment import make_environment
-    from .util import guess_encoding
+    from .dependencies import imported_files, changed_files
+    from .optimize import optimize_constant_writes
+    from .util import guess_encoding, stat_signature
 
 __version__ = '0.1a1'
 
+# inspect.CO_COROUTINE, without importing the slow inspect module
+_CO_COROUTINE = 0x80
+
 
 class HypertextGenerator(object):
     '''
@@ -41,7 +49,13 @@ class HypertextGenerator(object):
     # max number of file bytes to read at once
     BUFFER_SIZE = 300
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, dependency_graph=None, worker_pool=None, output_cache=None):
+        '''
+        :param filename: The script's file name.
+        :param dependency_graph: A :py:class:`pyhgss.dependencies.DependencyGraph` to record the script's dependencies in, optional.
+        :param worker_pool: A :py:class:`pyhgss.workers.ScriptWorkerPool` to execute the script in, optional. Without a pool, the script is executed in the calling thread.
+        :param output_cache: A :py:class:`pyhgss.sharedcache.SharedCache` to cache the script's output in, optional. Output is only cached if the script sets ``settings.cache`` to a number of seconds, and it is invalidated when any of the script's dependencies change.
+        '''
         if not filename.endswith(self.SUPPORTED_ENDINGS):
             logger.warning(
                 'File %(filename)s does not end with any of the supported endings (%(endings)s). It is strongly recommended to use the \'%(preferredending)s\' ending.',
@@ -53,11 +67,53 @@ class HypertextGenerator(object):
         self.fileencoding = guess_encoding(filename)
         self._filehash = None
         self._code = None
+        self._chunks = []
+        self._imports = []
+        # files that executions of the script used, with their stat signatures
+        self.dependencies = {}
+        self.dependency_graph = dependency_graph
+        self.worker_pool = worker_pool
+        self.output_cache = output_cache
         self.logger = logging.getLogger(__name__ + '.HypertextGenerator')
         self.logger.debug('Guessed encoding %s for file %s',
                           self.fileencoding, self.filename)
 
     def execute(self, override_opts=None) -> Tuple[Dict[str, str], bytes]:
+        '''Execute the script and return the tuple (headers, data) of its output.'''
+        if self.output_cache is not None:
+            cached = self.output_cache.get(self._output_key())
+            if cached is not None and not changed_files(cached[2]):
+                self.logger.debug('Using cached output of %s', self.filename)
+                return (cached[0], cached[1])
+
+        if self.worker_pool is not None:
+            headers, data, dependencies, cache_ttl = self.worker_pool.execute(
+                self.filename)
+            self._merge_dependencies(dependencies)
+        else:
+            environment_object = self.run(override_opts)
+            headers, data = environment_object.headers, b''.join(
+                environment_object.chunks)
+            dependencies = environment_object.dependencies
+            cache_ttl = self.cache_ttl(environment_object.cache_time)
+
+        if self.output_cache is not None and cache_ttl is not None:
+            self.output_cache.put(self._output_key(),
+                                  (headers, data, dependencies), ttl=cache_ttl)
+        return (headers, data)
+
+    def _output_key(self):
+        return ('output', str(Path(self.filename).absolute()))
+
+    @staticmethod
+    def cache_ttl(cache_time):
+        '''Return the time in seconds for which output may be cached according to the script's ``settings.cache``, or None if it may not be cached.'''
+        if isinstance(cache_time, (int, float)) and not isinstance(cache_time, bool) and cache_time > 0:
+            return cache_time
+        return None
+
+    def run(self, override_opts=None):
+        '''Execute the script in the calling thread and return the environment it was executed in, which contains the output and further information on the execution.'''
         if override_opts is None:
             override_opts = {}
         # TODO handle overriding execution options
@@ -83,26 +139,59 @@ class HypertextGenerator(object):
         # no code generated yet
         if filecode is None:
             self._filehash = sha1(bytecontents).digest()
-            filecode = compile(
-                contents, filename=self.filename, mode='exec', optimize=2)
+            # pre-encode constant output once instead of on every execution
+            tree, self._chunks = optimize_constant_writes(
+                ast.parse(contents, filename=self.filename), self.filename)
+            self._imports = imported_files(tree)
+            # scripts that use top-level await compile to a coroutine code object
+            filecode = compile(tree, filename=self.filename, mode='exec', optimize=2,
+                               flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
             self.logger.debug('Recompiled file %s (hash %s) to code object %s',
                               self.filename, self._filehash, filecode)
             self._code = filecode
 
         environment_object = make_environment(
-            encoding=self.fileencoding, script_name=self.filename, module_name=self.module_for_file(self.filename))
+            encoding=self.fileencoding, script_name=self.filename, module_name=self.module_for_file(self.filename),
+            constant_chunks=self._chunks)
         # inform environment of file encoding
         try:
-            exec(filecode, environment_object)
+            if filecode.co_flags & _CO_COROUTINE:
+                # asyncio is slow to import, only scripts that use await need it
+                import asyncio
+                self.logger.debug('Running %s on an event loop', self.filename)
+                asyncio.run(eval(filecode, environment_object))
+            else:
+                exec(filecode, environment_object)
         except _ScriptExited:
             pass
 
-        return (environment_object.headers, environment_object.data)
+        environment_object.dependencies = self.record_dependencies(
+            environment_object.loaded_files)
+        return environment_object
+
+    def record_dependencies(self, loaded_files) -> dict:
+        '''Record the script file, its imported modules and the given loaded files as dependencies of this script, and return them with their stat signatures.'''
+        dependencies = {filename: stat_signature(filename) for filename in
+                        [str(Path(self.filename).absolute()), *self._imports, *loaded_files]}
+        self._merge_dependencies(dependencies)
+        return dependencies
+
+    def _merge_dependencies(self, dependencies: dict):
+        self.dependencies = {**self.dependencies, **dependencies}
+        if self.dependency_graph is not None:
+            self.dependency_graph.record(self.filename, dependencies)
+
+    def changed_dependencies(self) -> list:
+        '''Return all files that this script used and that changed since.'''
+        return changed_files(self.dependencies)
 
     def module_for_file(self, filename: str) -> str:
-        '''Return the Python module name for the given file name. This depends on the current directory.'''
+        '''Return the Python module name for the given file name. This depends on the current directory; files outside of it are named after their file name only.'''
         current_directory = Path('.').resolve()
-        relative_path = str(Path(filename).relative_to(current_directory))
+        try:
+            relative_path = str(Path(filename).resolve().relative_to(current_directory))
+        except ValueError:
+            relative_path = Path(filename).name
         module_with_ending = relative_path.replace('\\', '/').replace('./', '.').replace('/', '.')
         # The sorting ensures that the replace doesn't catch wrong substrings of endings.
         for ending in sorted(HypertextGenerator.SUPPORTED_ENDINGS, key=len,reverse=True):
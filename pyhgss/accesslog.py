@@ -0,0 +1,103 @@
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler
+
+logger = logging.getLogger(__name__)
+
+
+class _AccessQueueHandler(QueueHandler):
+    '''Queue handler that enqueues access records as they are. They carry no message to format, so the request thread doesn't do any formatting work.'''
+
+    def prepare(self, record):
+        return record
+
+
+class AccessLog(object):
+    '''
+    Structured access log that writes one line per response to a file.
+
+    Request handlers only create a log record and put it into a queue (through a :py:class:`logging.handlers.QueueHandler` on the ``pyhgss.access`` logger). A background thread takes the records from the queue in batches, formats them and writes every batch to the file at once.
+
+    Supported formats are ``'json'`` (JSON lines) and ``'common'`` (the Common Log Format of most web servers).
+    '''
+
+    FORMATS = ('json', 'common')
+
+    def __init__(self, filename: str, format: str = 'json', max_batch: int = 256):
+        '''
+        :param filename: The file to append the access log to.
+        :param format: The format of the log lines, one of :py:attr:`FORMATS`.
+        :param max_batch: The maximum number of records that are written at once.
+        '''
+        if format not in self.FORMATS:
+            raise ValueError(f'unknown access log format {format}')
+        self.filename = filename
+        self.format = format
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self.logger = logging.getLogger('pyhgss.access')
+        # access records only go to the access log, never to the normal log output
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self._handler = _AccessQueueHandler(self._queue)
+
+    def start(self):
+        '''Start the background writer and attach the queue to the access logger.'''
+        self._thread = threading.Thread(target=self._write_batches, daemon=True,
+                                        name='pyhgss-access-log')
+        self._thread.start()
+        self.logger.addHandler(self._handler)
+
+    def stop(self):
+        '''Detach the queue from the access logger and wait until all queued records are written.'''
+        self.logger.removeHandler(self._handler)
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def log(self, client: str, requestline: str, code: int, size=None):
+        '''
+        Log a single response. This is called on the request thread and only enqueues the data.
+
+        :param size: The number of bytes in the response body, or None if it is unknown.
+        '''
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('', extra={'client': client, 'requestline': requestline,
+                                        'code': code, 'size': size})
+
+    def _write_batches(self):
+        with open(self.filename, 'a', encoding='utf-8') as file:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in batch
+                file.write(''.join(self.format_record(record)
+                                   for record in batch if record is not None))
+                file.flush()
+                if stop:
+                    break
+
+    def format_record(self, record: logging.LogRecord) -> str:
+        '''Format an access record as a single line, including the line break.'''
+        size = record.size if record.size not in (None, '', '-') else None
+        if self.format == 'json':
+            return json.dumps({
+                'time': round(record.created, 3),
+                'client': record.client,
+                'request': record.requestline,
+                'status': record.code,
+                'size': size,
+            }) + '\n'
+        timestamp = time.strftime('%d/%b/%Y:%H:%M:%S %z',
+                                  time.localtime(record.created))
+        requestline = record.requestline.replace('"', '\\"')
+        return f'{record.client} - - [{timestamp}] "{requestline}" {record.code} {size if size is not None else "-"}\n'
@@ -0,0 +1,144 @@
+import json
+import logging
+import posixpath
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController(object):
+    '''
+    Limits the number of PyHG scripts that are executed at the same time.
+
+    Requests that exceed the limit wait in a bounded first-in-first-out queue. Requests are shed, i.e. refused, if the queue is full or if they waited longer than the queue timeout. The controller counts admitted and shed requests for monitoring.
+    '''
+
+    def __init__(self, max_concurrent: int, max_queue: int = None, queue_timeout: float = 10):
+        '''
+        :param max_concurrent: The maximum number of scripts that are executed at the same time.
+        :param max_queue: The maximum number of requests waiting for execution, defaults to twice the concurrency limit.
+        :param queue_timeout: The maximum number of seconds that a request waits in the queue.
+        '''
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue if max_queue is not None else 2 * max_concurrent
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.shed_full = 0
+        self.shed_timeout = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+
+    def acquire(self) -> bool:
+        '''Wait until a script may be executed. Returns False if the request is shed instead; otherwise :py:meth:`release` must be called after the execution.'''
+        with self._condition:
+            if self.active < self.max_concurrent and not self._waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if len(self._waiting) >= self.max_queue:
+                self.shed_full += 1
+                return False
+
+            ticket = object()
+            self._waiting.append(ticket)
+            deadline = time.monotonic() + self.queue_timeout
+            while self._waiting[0] is not ticket or self.active >= self.max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self.shed_timeout += 1
+                    # the next request might be at the head of the queue now
+                    self._condition.notify_all()
+                    return False
+                self._condition.wait(remaining)
+            self._waiting.popleft()
+            self.active += 1
+            self.admitted += 1
+            self._condition.notify_all()
+            return True
+
+    def release(self):
+        '''Signal that an admitted script finished executing.'''
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        '''Return the current state and counters of this controller.'''
+        with self._condition:
+            return {
+                'active': self.active,
+                'queued': len(self._waiting),
+                'admitted': self.admitted,
+                'shed_queue_full': self.shed_full,
+                'shed_queue_timeout': self.shed_timeout,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+            }
+
+
+class AdmissionControlMixin(object):
+    '''
+    Mixin for the PyHG request handlers in :py:mod:`pyhgss.serve` that puts script execution under admission control. Static files are not affected. Use :py:func:`admission_controlled` to create a handler class with this mixin.
+
+    Shed requests are answered immediately with 503 Service Unavailable and a ``Retry-After`` header.
+
+    :param admission_controller: The :py:class:`AdmissionController` that is shared by all requests.
+    :param retry_after: The number of seconds that shed clients are told to wait.
+    :param metrics_path: The path on which the controller's metrics are served as JSON, optional.
+    '''
+
+    def __init__(self, *args, admission_controller=None, retry_after=1, metrics_path=None, **kwargs):
+        if admission_controller is None:
+            raise ValueError('admission_controller must not be None')
+        self.admission_controller = admission_controller
+        self.retry_after = retry_after
+        self.metrics_path = metrics_path
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if (self.metrics_path is not None
+                and posixpath.normpath(urllib.parse.urlparse(self.path).path) == self.metrics_path):
+            self.send_metrics()
+            return
+        super().do_GET()
+
+    def send_script(self, script):
+        if not self.admission_controller.acquire():
+            self.send_overloaded()
+            return
+        try:
+            super().send_script(script)
+        finally:
+            self.admission_controller.release()
+
+    def send_overloaded(self):
+        '''Send the response for a shed request.'''
+        body = b'Server overloaded, please retry later.\n'
+        self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+        self.send_header('Retry-After', str(self.retry_after))
+        self.send_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_metrics(self):
+        '''Send the admission controller's metrics as JSON.'''
+        body = json.dumps(self.admission_controller.metrics()).encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def admission_controlled(handler_class):
+    '''Return a subclass of the given request handler class whose script executions are under admission control, see :py:class:`AdmissionControlMixin`.'''
+    return type('AdmissionControlled' + handler_class.__name__,
+                (AdmissionControlMixin, handler_class), {})
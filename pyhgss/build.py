@@ -0,0 +1,263 @@
+import gzip
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import shutil
+import os.path as pathtools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+
+if __name__ == 'build' or __name__ == '__main__':
+    from __init__ import HypertextGenerator
+    from environment import HypertextGenerationEnvironment
+    from serve import find_script, is_legal_static_file
+    from util import stat_signature
+else:
+    from . import HypertextGenerator
+    from .environment import HypertextGenerationEnvironment
+    from .serve import find_script, is_legal_static_file
+    from .util import stat_signature
+
+logger = logging.getLogger(__name__)
+
+# name of the build manifest inside the output directory
+MANIFEST_NAME = '.pyhgss-build.json'
+MANIFEST_VERSION = 1
+
+# content types that are worth precompressing, apart from text/*
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml')
+
+
+def render(scriptfile: str) -> dict:
+    '''
+    Execute a single PyHG script for the static build. This runs in a worker process.
+
+    :returns: A dictionary with the script's headers and data, the files it depends on and whether it may be pre-rendered at all.
+    '''
+    generator = HypertextGenerator(scriptfile)
+    environment = generator.run()
+    return {
+        'headers': environment.headers,
+        'data': b''.join(environment.chunks),
+        'dependencies': generator.dependencies,
+        'cacheable': environment.cache_time != HypertextGenerationEnvironment.never,
+    }
+
+
+def output_name(route: str, headers: dict) -> str:
+    '''Return the output file name (relative to the output directory) for the given route, with a file ending that matches the Content-Type header.'''
+    content_type = headers.get('Content-Type', '').split(';')[0].strip()
+    ending = mimetypes.guess_extension(content_type) if content_type else None
+    name = route.lstrip('/')
+    if ending is not None and not name.endswith(ending):
+        name += ending
+    return name
+
+
+def is_compressible(content_type: str) -> bool:
+    '''Check whether content of the given type should be precompressed.'''
+    if content_type is None:
+        return False
+    content_type = content_type.split(';')[0].strip()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def is_up_to_date(entry: dict, scriptfile: str, output: str) -> bool:
+    '''Check whether a route's entry from a previous build is still valid, i.e. neither the script nor any of its dependencies changed.'''
+    if entry is None or entry.get('script') != scriptfile:
+        return False
+    if not pathtools.isfile(pathtools.join(output, entry['output'])):
+        return False
+    return all(stat_signature(filename) == (tuple(signature) if signature is not None else None)
+               for filename, signature in entry['dependencies'].items())
+
+
+def write_output(output: str, name: str, data: bytes, compress: bool, content_type: str):
+    '''Write a single output file and, if requested, its precompressed variant.'''
+    target = pathtools.join(output, name)
+    os.makedirs(pathtools.dirname(target), exist_ok=True)
+    with open(target, 'wb') as file:
+        file.write(data)
+    if compress and is_compressible(content_type):
+        with open(target + '.gz', 'wb') as file:
+            file.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+
+def copy_static(filename: str, target: str, compress: bool, force: bool):
+    '''Copy a static file to the output directory if it changed since the last build, and precompress it if requested.'''
+    if not force and stat_signature(target) == stat_signature(filename):
+        return
+    logger.debug('Copying static file %s', filename)
+    os.makedirs(pathtools.dirname(target), exist_ok=True)
+    shutil.copy2(filename, target)
+    if compress and is_compressible(mimetypes.guess_type(filename)[0]):
+        with open(filename, 'rb') as file:
+            data = file.read()
+        with open(target + '.gz', 'wb') as file:
+            file.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+
+def remove_output(output: str, name: str):
+    '''Remove an output file and its precompressed variant, if they exist.'''
+    for target in (pathtools.join(output, name), pathtools.join(output, name) + '.gz'):
+        if pathtools.isfile(target):
+            os.remove(target)
+
+
+def load_manifest(output: str) -> dict:
+    '''Load the manifest of a previous build in the output directory, or return an empty manifest.'''
+    try:
+        with open(pathtools.join(output, MANIFEST_NAME), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+        logger.info('Ignoring build manifest of different version')
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'routes': {}, 'static': []}
+
+
+def collect_files(source: str, toserve: str, exclude: str = None):
+    '''
+    Traverse a folder with the routing rules of :py:class:`pyhgss.serve.HierarchicalPyghssHTTPRequestHandler`.
+
+    :param source: The absolute name of the folder, i.e. the website root.
+    :param toserve: Which static files are served, see :py:func:`pyhgss.serve.is_legal_static_file`.
+    :param exclude: An absolute folder name that is skipped, optional.
+    :returns: The tuple (mapping of routes to script file names, list of static file names relative to the folder).
+    '''
+    scripts = {}
+    static = []
+    for directory, subdirectories, files in os.walk(source):
+        subdirectories[:] = [sub for sub in subdirectories
+                             if pathtools.join(directory, sub) != exclude]
+        for filename in files:
+            fullname = pathtools.join(directory, filename)
+            relative = pathtools.relpath(fullname, source).replace(os.sep, '/')
+            if filename.endswith(HypertextGenerator.SUPPORTED_ENDINGS):
+                route = '/' + relative
+                for ending in sorted(HypertextGenerator.SUPPORTED_ENDINGS, key=len, reverse=True):
+                    if route.endswith(ending):
+                        route = route[:-len(ending)]
+                        break
+                route = posixpath.normpath(route)
+                if find_script(source, route, toserve) == fullname:
+                    scripts[route] = fullname
+                else:
+                    logger.warning('Script %s is shadowed by another script on route %s',
+                                   relative, route)
+            elif is_legal_static_file(fullname, toserve):
+                static.append(relative)
+    return scripts, static
+
+
+def build(source: str, output: str, serve_arbitrary_files=True, compress=False, jobs=None, force=False) -> int:
+    '''
+    Pre-render a folder of PyHG scripts into static files.
+
+    The folder is traversed with the same routing rules that :py:class:`pyhgss.serve.HierarchicalPyghssHTTPRequestHandler` uses. Every script is executed once and its output written to the output directory, under the script's route with a file ending that matches its Content-Type. Scripts that set ``settings.cache = never`` are skipped. Static files are copied as they would be served. The headers and dependencies of every script are stored in the build manifest, which is used to only re-render scripts whose source or loaded files changed.
+
+    :param source: The folder to build, i.e. the website root.
+    :param output: The folder to write the static files to.
+    :param serve_arbitrary_files: Which static files to copy, see :py:class:`pyhgss.serve.HierarchicalPyghssHTTPRequestHandler`.
+    :param compress: Whether to additionally write gzip-compressed ``.gz`` variants of textual output files.
+    :param jobs: Number of worker processes to execute scripts in, defaults to the number of processors. With 1, scripts are executed in this process.
+    :param force: Re-render all scripts, even if they didn't change.
+    :returns: The number of scripts that failed to execute.
+    '''
+    source = pathtools.abspath(source)
+    output = pathtools.abspath(output)
+    toserve = (None if serve_arbitrary_files is False
+               else 'html' if serve_arbitrary_files == 'html'
+               else 'all')
+    old_manifest = load_manifest(output)
+    manifest = {'version': MANIFEST_VERSION, 'routes': {}, 'static': []}
+
+    scripts, manifest['static'] = collect_files(source, toserve, exclude=output)
+
+    to_render = {}
+    for route, scriptfile in scripts.items():
+        entry = old_manifest['routes'].get(route)
+        if not force and is_up_to_date(entry, scriptfile, output):
+            logger.debug('Route %s is up to date', route)
+            manifest['routes'][route] = entry
+        else:
+            to_render[route] = scriptfile
+
+    failures = 0
+    if to_render:
+        logger.info('Rendering %d of %d scripts', len(to_render), len(scripts))
+        if jobs == 1:
+            executor = nullcontext()
+            results = ((route, _try_render(scriptfile))
+                       for route, scriptfile in to_render.items())
+        else:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            results = _pool_results({route: executor.submit(_try_render, scriptfile)
+                                     for route, scriptfile in to_render.items()})
+        with executor:
+            for route, result in results:
+                if result is None:
+                    failures += 1
+                    continue
+                if not result['cacheable']:
+                    logger.info('Skipping uncacheable script on route %s', route)
+                    continue
+                name = output_name(route, result['headers'])
+                write_output(output, name, result['data'], compress,
+                             result['headers'].get('Content-Type'))
+                manifest['routes'][route] = {
+                    'script': to_render[route],
+                    'output': name,
+                    'headers': result['headers'],
+                    'dependencies': result['dependencies'],
+                }
+                logger.info('Rendered %s to %s', route, name)
+
+    current_outputs = {entry['output']
+                       for entry in manifest['routes'].values()}
+    for relative in manifest['static']:
+        if relative in current_outputs:
+            logger.warning('Static file %s is overwritten by script output', relative)
+            continue
+        copy_static(pathtools.join(source, relative),
+                    pathtools.join(output, relative), compress, force)
+
+    # clean up files from previous builds that are gone now
+    for route, entry in old_manifest['routes'].items():
+        if route not in manifest['routes'] and entry['output'] not in current_outputs:
+            logger.info('Removing stale output %s', entry['output'])
+            remove_output(output, entry['output'])
+    for relative in set(old_manifest['static']) - set(manifest['static']) - current_outputs:
+        logger.info('Removing stale static file %s', relative)
+        remove_output(output, relative)
+
+    os.makedirs(output, exist_ok=True)
+    with open(pathtools.join(output, MANIFEST_NAME), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1)
+
+    return failures
+
+
+def _try_render(scriptfile: str) -> dict:
+    '''Like :py:func:`render`, but log exceptions and return None instead of raising them.'''
+    try:
+        return render(scriptfile)
+    except (Exception, SystemExit):
+        # a script calling sys.exit() must not end the whole build
+        logger.exception('Script %s failed', scriptfile)
+        return None
+
+
+def _pool_results(futures: dict):
+    '''Yield the tuples (route, result) of the render futures in order. Scripts that crashed their worker process, and all scripts that were still waiting for that pool, yield None as their result.'''
+    for route, future in futures.items():
+        try:
+            yield route, future.result()
+        except BrokenProcessPool:
+            logger.error('Worker process crashed while rendering route %s', route)
+            yield route, None
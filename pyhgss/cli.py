@@ -1,4 +1,3 @@
-import argparse
 import logging
 
 global script_dictionary
@@ -7,8 +6,13 @@ logger = logging.getLogger(__name__)
 
 
 def cli(*args):
+    import argparse
     import os
     import sys
+    if len(args) > 0 and args[0] == 'build':
+        return build_cli(*args[1:])
+    if len(args) > 0 and args[0] == 'deps':
+        return deps_cli(*args[1:])
     if __name__ == 'cli' or __name__ == '__main__':
         # use absolute import if this is at the top level of the package structure
         from serve import HierarchicalPyghssHTTPRequestHandler as FolderHandler, SinglePyghssHTTPRequestHandler as SingleHandler, MultiplePyhgssHTTPRequestHandler as MultiHandler
@@ -61,11 +65,107 @@ def cli(*args):
                         action='store', type=int, default=80,
                         help='Which port to bind to. Defaults to 80 (http standard).\
             This can cause problems if other applications are listening on the same port.')
+    parser.add_argument('--processes', '-P', dest='processes',
+                        action='store', type=int, default=None, metavar='N',
+                        help='Execute the scripts in a pool of N worker processes instead of the\
+            server\'s threads, so that CPU-heavy scripts can use all processor cores and\
+            crashing scripts don\'t affect the server. 0 uses one process per processor.')
+    parser.add_argument('--max-requests', dest='maxRequests',
+                        action='store', type=int, default=1000,
+                        help='With --processes, replace a worker process after it handled this many requests.\
+            Defaults to 1000, 0 never replaces workers because of their request count.')
+    parser.add_argument('--max-memory', dest='maxMemory',
+                        action='store', type=int, default=None,
+                        help='With --processes, replace a worker process once it uses more than this many\
+            megabytes of memory.')
+    parser.add_argument('--shared-cache', dest='sharedCache',
+                        action='store', default=None, metavar='CACHEFILE',
+                        help='Cache script output and detected file encodings in this memory-mapped\
+            file, which can be shared by several server processes. Script output is only\
+            cached if the script sets "settings.cache" to a number of seconds.')
+    parser.add_argument('--shared-cache-size', dest='sharedCacheSize',
+                        action='store', type=int, default=64,
+                        help='Size of the shared cache file in megabytes. Defaults to 64.\
+            If the file already is a cache, its existing size is used.')
+    parser.add_argument('--max-scripts', dest='maxScripts',
+                        action='store', type=int, default=None,
+                        help='Execute at most this many scripts at the same time. Further requests\
+            for scripts wait in a queue, static files are not affected. Requests that\
+            don\'t fit into the queue or wait too long are answered with\
+            "503 Service Unavailable".')
+    parser.add_argument('--queue-size', dest='queueSize',
+                        action='store', type=int, default=None,
+                        help='With --max-scripts, the number of requests that may wait for execution.\
+            Defaults to twice the --max-scripts limit.')
+    parser.add_argument('--queue-timeout', dest='queueTimeout',
+                        action='store', type=float, default=10,
+                        help='With --max-scripts, the number of seconds a request may wait for execution. Defaults to 10.')
+    parser.add_argument('--metrics-path', dest='metricsPath',
+                        action='store', default=None,
+                        help='With --max-scripts, serve the queue metrics as JSON on this path, e.g. "/.metrics".')
+    parser.add_argument('--access-log', dest='accessLog',
+                        action='store', default=None, metavar='LOGFILE',
+                        help='Append a line for every response to this file. The lines are written\
+            in batches by a background thread.')
+    parser.add_argument('--access-log-format', dest='accessLogFormat',
+                        action='store', default='json', choices=('json', 'common'),
+                        help='Format of the access log: JSON lines (the default) or the\
+            Common Log Format.')
 
     arguments = parser.parse_args(args)
 
     logger.debug(arguments)
 
+    shared_cache = None
+    if arguments.sharedCache is not None:
+        if __name__ == 'cli' or __name__ == '__main__':
+            from sharedcache import SharedCache
+            from util import use_encoding_cache
+        else:
+            from .sharedcache import SharedCache
+            from .util import use_encoding_cache
+        try:
+            shared_cache = SharedCache(arguments.sharedCache,
+                                       size=arguments.sharedCacheSize * 1024 * 1024)
+        except ValueError as error:
+            parser.print_usage()
+            print(parser.prog + ': error:', error)
+            sys.exit(-1)
+        use_encoding_cache(shared_cache)
+
+    worker_pool = None
+    if arguments.processes is not None:
+        if __name__ == 'cli' or __name__ == '__main__':
+            from workers import ScriptWorkerPool
+        else:
+            from .workers import ScriptWorkerPool
+        worker_pool = ScriptWorkerPool(arguments.processes or None,
+                                       max_requests=arguments.maxRequests or None,
+                                       max_rss=arguments.maxMemory * 1024 * 1024 if arguments.maxMemory else None,
+                                       encoding_cache=shared_cache)
+
+    admission_controller = None
+    if arguments.maxScripts is not None:
+        if __name__ == 'cli' or __name__ == '__main__':
+            from admission import AdmissionController, admission_controlled
+        else:
+            from .admission import AdmissionController, admission_controlled
+        admission_controller = AdmissionController(arguments.maxScripts,
+                                                   max_queue=arguments.queueSize,
+                                                   queue_timeout=arguments.queueTimeout)
+        FolderHandler = admission_controlled(FolderHandler)
+        SingleHandler = admission_controlled(SingleHandler)
+        MultiHandler = admission_controlled(MultiHandler)
+
+    access_log = None
+    if arguments.accessLog is not None:
+        if __name__ == 'cli' or __name__ == '__main__':
+            from accesslog import AccessLog
+        else:
+            from .accesslog import AccessLog
+        access_log = AccessLog(arguments.accessLog, format=arguments.accessLogFormat)
+        access_log.start()
+
     try:
         handler_class = None
         if len(arguments.file) == 1:
@@ -81,10 +181,13 @@ def cli(*args):
                 script_dictionary = dict()
                 handler_class = partial(FolderHandler, directory=arguments.file,
                                         serve_arbitrary_files=serve_restriction,
-                                        scriptdict=script_dictionary)
+                                        scriptdict=script_dictionary, worker_pool=worker_pool,
+                                        output_cache=shared_cache)
             else:
                 handler_class = partial(
-                    SingleHandler, filename=arguments.file, script=HypertextGenerator(arguments.file))
+                    SingleHandler, filename=arguments.file,
+                    script=HypertextGenerator(arguments.file, worker_pool=worker_pool,
+                                              output_cache=shared_cache))
         else:
             for fname in arguments.file:
                 if not os.path.exists(fname):
@@ -95,14 +198,18 @@ def cli(*args):
                         f'multiple files given, but {fname} is a directory')
             script_dictionary = dict()
             handler_class = partial(
-                MultiHandler, files=arguments.file, scriptdict=script_dictionary)
+                MultiHandler, files=arguments.file, scriptdict=script_dictionary,
+                worker_pool=worker_pool, output_cache=shared_cache)
 
         logger.debug(handler_class)
 
         # nest da partial
         logr = logging.getLogger(
             __package__ + '.server' if len(__package__) > 0 else 'server')
-        handler_class = partial(handler_class, logger=logr)
+        handler_class = partial(handler_class, logger=logr, access_log=access_log)
+        if admission_controller is not None:
+            handler_class = partial(handler_class, admission_controller=admission_controller,
+                                    metrics_path=arguments.metricsPath)
 
         srver = ThreadingHTTPServer(
             (arguments.host, arguments.port), handler_class)
@@ -112,8 +219,137 @@ def cli(*args):
             srver.serve_forever()
         except KeyboardInterrupt:
             print(f'Closing server.')
+        finally:
+            if worker_pool is not None:
+                worker_pool.shutdown()
+            if access_log is not None:
+                access_log.stop()
 
     except argparse.ArgumentTypeError as e:
         parser.print_usage()
         print(parser.prog + ': error:', e)
         sys.exit(-1)
+
+
+def build_cli(*args):
+    import argparse
+    import os
+    import sys
+    if __name__ == 'cli' or __name__ == '__main__':
+        from build import build
+    else:
+        from .build import build
+    parser = argparse.ArgumentParser('pyhgss build',
+                                     description='Pre-render a folder of pyhg scripts into static files',
+                                     epilog='Copyright 2019, kleinesfilmroellchen')
+
+    parser.add_argument('source', action='store', metavar='SRC',
+                        help='The folder to pre-render, with the same routing rules as when serving it.\
+            Every script is executed once and its output written to OUT\
+            under the script\'s path, with a file ending that matches its\
+            Content-Type. Scripts that set "settings.cache = never" are skipped.')
+    parser.add_argument('output', action='store', metavar='OUT',
+                        help='The folder to write the static files and the build manifest to.')
+    parser.add_argument('--no-arbitrary-files', '-n', dest='arbitraryFiles',
+                        action='store_false', default=True,
+                        help='Do not copy static files that are not pyhg scripts, see the server\'s option.')
+    parser.add_argument('--serve-html', '-t', dest='allowHTML',
+                        action='store_true', default=False,
+                        help='Copy HTML files even if --no-arbitrary-files is given.')
+    parser.add_argument('--compress', '-z', dest='compress',
+                        action='store_true', default=False,
+                        help='Additionally write gzip-compressed ".gz" files next to textual outputs.')
+    parser.add_argument('--jobs', '-j', dest='jobs',
+                        action='store', type=int, default=None,
+                        help='Number of processes to execute scripts in. Defaults to the number of processors.')
+    parser.add_argument('--force', '-f', dest='force',
+                        action='store_true', default=False,
+                        help='Re-render all scripts, even those whose source and loaded files did not change.')
+
+    arguments = parser.parse_args(args)
+
+    logger.debug(arguments)
+
+    if not os.path.isdir(arguments.source):
+        parser.print_usage()
+        print(parser.prog + ': error:', f'directory {arguments.source} does not exist')
+        sys.exit(-1)
+
+    serve_restriction = arguments.arbitraryFiles
+    if serve_restriction is False:
+        serve_restriction = 'html' if arguments.allowHTML else False
+    failures = build(arguments.source, arguments.output,
+                     serve_arbitrary_files=serve_restriction, compress=arguments.compress,
+                     jobs=arguments.jobs, force=arguments.force)
+    if failures > 0:
+        print(f'{failures} script(s) failed.')
+        sys.exit(1)
+
+
+def deps_cli(*args):
+    import argparse
+    import os
+    import sys
+    if __name__ == 'cli' or __name__ == '__main__':
+        from __init__ import HypertextGenerator
+        from build import collect_files
+        from dependencies import DependencyGraph
+    else:
+        from . import HypertextGenerator
+        from .build import collect_files
+        from .dependencies import DependencyGraph
+    parser = argparse.ArgumentParser('pyhgss deps',
+                                     description='Show the files that pyhg scripts depend on: the script, the modules it\
+            imports directly or indirectly (dynamic imports with importlib or __import__\
+            are not found) and the files it loads.',
+                                     epilog='Copyright 2019, kleinesfilmroellchen')
+
+    parser.add_argument('path', action='store', metavar='PATH',
+                        help='The pyhg script to inspect. If a folder is given, inspect all\
+            scripts that would be served from the folder. The scripts are\
+            executed once to find out which files they load.')
+    parser.add_argument('--reverse', '-r', dest='reverse',
+                        action='store_true', default=False,
+                        help='List every file together with the scripts that depend on it, instead of\
+            every script with the files it depends on.')
+
+    arguments = parser.parse_args(args)
+
+    logger.debug(arguments)
+
+    if not os.path.exists(arguments.path):
+        parser.print_usage()
+        print(parser.prog + ': error:', f'file or directory {arguments.path} does not exist')
+        sys.exit(-1)
+
+    path = os.path.abspath(arguments.path)
+    if os.path.isdir(path):
+        scripts = list(collect_files(path, 'all')[0].values())
+    else:
+        scripts = [path]
+
+    graph = DependencyGraph()
+    for script in scripts:
+        try:
+            HypertextGenerator(script, dependency_graph=graph).run()
+        except Exception:
+            logger.exception('Script %s failed, its dependencies may be incomplete', script)
+
+    if arguments.reverse:
+        files = sorted({filename for script in graph.scripts()
+                        for filename in graph.dependencies(script)})
+        for filename in files:
+            dependents = sorted(script for script in graph.dependents(filename)
+                                if script != filename)
+            if not dependents:
+                # a script file that no other script depends on
+                continue
+            print(os.path.relpath(filename))
+            for script in dependents:
+                print('    ' + os.path.relpath(script))
+    else:
+        for script in sorted(graph.scripts()):
+            print(os.path.relpath(script))
+            for filename in sorted(graph.dependencies(script)):
+                if filename != script:
+                    print('    ' + os.path.relpath(filename))
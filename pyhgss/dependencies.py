@@ -0,0 +1,145 @@
+import ast
+import functools
+import importlib.util
+import logging
+import threading
+import os.path as pathtools
+
+if __name__ == 'dependencies' or __name__ == '__main__':
+    from util import stat_signature
+else:
+    from .util import stat_signature
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def installation_paths() -> tuple:
+    '''Return the folders of the Python installation. Modules in these folders are never tracked.'''
+    import sysconfig
+    return tuple(pathtools.abspath(path) + pathtools.sep for path in
+                 {sysconfig.get_paths()[name] for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+
+
+def imported_modules(tree: ast.AST, package: str = None) -> set:
+    '''
+    Return the absolute names of all modules that the given code imports statically, including the parent packages of imported submodules.
+
+    :param package: The package that the code belongs to, for resolving relative imports. Relative imports are ignored without it.
+    '''
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            if node.level == 0:
+                base = node.module
+            elif package is not None:
+                try:
+                    base = importlib.util.resolve_name(
+                        '.' * node.level + (node.module or ''), package)
+                except ImportError:
+                    continue
+            else:
+                continue
+            if base is None:
+                continue
+            # the imported names might be submodules
+            names = [base] + [base + '.' + alias.name for alias in node.names if alias.name != '*']
+        else:
+            continue
+        for name in names:
+            parts = name.split('.')
+            modules.update('.'.join(parts[:end]) for end in range(1, len(parts) + 1))
+    return modules
+
+
+def imported_files(tree: ast.AST) -> list:
+    '''
+    Find the source files of all modules that the given script imports and that are not part of the Python installation.
+
+    Imports are followed transitively: the modules that these modules import are found as well, so a script depends on every helper module that it uses indirectly. Only imports that are written as ``import`` statements are found; modules that are imported dynamically, e.g. with :py:func:`importlib.import_module` or ``__import__()``, are not. Modules that can't be found are ignored, as the import will fail at run time anyways.
+    '''
+    files = []
+    seen = set()
+    pending = [(tree, None)]
+    while pending:
+        tree, package = pending.pop()
+        for module in sorted(imported_modules(tree, package) - seen):
+            seen.add(module)
+            try:
+                spec = importlib.util.find_spec(module)
+            except (ImportError, ValueError):
+                spec = None
+            if spec is None or not spec.has_location or spec.origin is None:
+                continue
+            origin = pathtools.abspath(spec.origin)
+            if origin.startswith(installation_paths()):
+                continue
+            files.append(origin)
+            if origin.endswith('.py'):
+                try:
+                    with open(origin, 'rb') as file:
+                        module_tree = ast.parse(file.read(), origin)
+                except (OSError, SyntaxError, ValueError):
+                    continue
+                pending.append((module_tree, spec.name if spec.submodule_search_locations is not None
+                                else spec.parent))
+    return files
+
+
+def changed_files(dependencies: dict) -> list:
+    '''Return the files from the given mapping of file names to stat signatures that changed since the signatures were taken.'''
+    return [filename for filename, signature in dependencies.items()
+            if stat_signature(filename) != signature]
+
+
+class DependencyGraph(object):
+    '''
+    Keeps track of the files that PyHG scripts depend on: the script itself, the modules it imports and the files it loads with ``load()``.
+
+    Every dependency is stored with the stat signature it had when the script last used it, so that caches built on the scripts' output can find out exactly which scripts are affected by a changed file. The graph can be shared between threads.
+    '''
+
+    def __init__(self):
+        self._dependencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, script: str, dependencies: dict):
+        '''
+        Record dependencies of a script. Previously recorded dependencies of the script are kept, as different executions may use different files.
+
+        :param script: The script's file name.
+        :param dependencies: A mapping of dependency file names to their stat signatures.
+        '''
+        with self._lock:
+            self._dependencies[script] = {
+                **self._dependencies.get(script, {}), **dependencies}
+
+    def forget(self, script: str):
+        '''Remove all dependencies of the given script, e.g. after its cached output was dropped.'''
+        with self._lock:
+            self._dependencies.pop(script, None)
+
+    def dependencies(self, script: str) -> dict:
+        '''Return the recorded dependencies of a script with their stat signatures.'''
+        with self._lock:
+            return dict(self._dependencies.get(script, {}))
+
+    def dependents(self, filename: str) -> set:
+        '''Return all scripts that depend on the given file.'''
+        filename = pathtools.abspath(filename)
+        with self._lock:
+            return {script for script, dependencies in self._dependencies.items()
+                    if filename in dependencies}
+
+    def scripts(self) -> list:
+        '''Return all scripts in this graph.'''
+        with self._lock:
+            return list(self._dependencies.keys())
+
+    def changed_scripts(self) -> set:
+        '''Return all scripts of which any dependency changed since it was recorded.'''
+        with self._lock:
+            items = list(self._dependencies.items())
+        return {script for script, dependencies in items if changed_files(dependencies)}
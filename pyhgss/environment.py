@@ -1,9 +1,10 @@
 from pathlib import Path
 from util import guess_encoding
+from optimize import ConstantChunk
+from fragments import FragmentCapture, default_fragment_cache
 import logging
 import time
 import sys
-import bs4
 
 from functools import singledispatchmethod
 from enum import Enum
@@ -25,8 +26,8 @@ def make_environment(**kwargs):
 
 
 # list of inaccessible methods of HypertextGenerationEnvironment
-PRIVATE_METHODS = ['id', 'logger',
-                   '_change_setting', 'setting_changer', 'headers']
+PRIVATE_METHODS = ['id', 'logger', '_write_html',
+                   '_change_setting', 'setting_changer', 'headers', 'loaded_files', 'fragment_cache']
 
 
 class Type(Enum):
@@ -59,19 +60,27 @@ class HypertextGenerationEnvironment(dict):
             '''The string conversion wraps the code in a simple script tag.'''
             return '<script>' + self.code + '</script>'
 
-    def __init__(self, script_name: str, module_name: str, encoding: str):
+    def __init__(self, script_name: str, module_name: str, encoding: str, constant_chunks=(), fragment_cache=None):
         '''
-        The constructor of the environment does not take any arguments.
+        :param constant_chunks: The pre-computed :py:class:`pyhgss.optimize.ConstantChunk` objects of the script's compiled code.
+        :param fragment_cache: The :py:class:`pyhgss.fragments.FragmentCache` for ``cache_fragment()``, defaults to the cache shared by all scripts.
         '''
         self.id = time.time_ns()
         self.logger = logging.getLogger(
             __name__ + '.' + str(abs(hash(self)))[:6])
-        self.data = bytes()
+        # encoded output pieces, joined only once the script has finished
+        self.chunks = []
         self.file_encoding = encoding
         self.__selected_autoformatter = lambda html: html.prettify()
         self.headers = dict()
         self.script_name = script_name
         self.module_name = module_name
+        self.__pyhgss_chunks__ = constant_chunks
+        # absolute names of all files that the script loaded
+        self.loaded_files = []
+        # caching time in seconds, or never; None if the script didn't say
+        self.cache_time = None
+        self.fragment_cache = fragment_cache if fragment_cache is not None else default_fragment_cache
 
     @property
     def __name__(self):
@@ -110,7 +119,7 @@ class HypertextGenerationEnvironment(dict):
 
         This method is overwritten as to prevent certain lookups (e.g. __getattribute__ itself) and to redirect some other lookups, most importantly the pseudo-object ``settings``.
         '''
-        if name != '__getattribute__' and name != '__setattr__':
+        if name != '__getattribute__' and name != '__setattr__' and logger.isEnabledFor(5):
             logger.log(5, 'Get %s', name)
 
         val = None
@@ -132,7 +141,7 @@ class HypertextGenerationEnvironment(dict):
         This method is overwritten as to prevent certain assignments (e.g. __setattr__ itself).
         '''
         super().__setattr__(name, value)
-        if name != '__getattribute__' and name != '__setattr__':
+        if name != '__getattribute__' and name != '__setattr__' and logger.isEnabledFor(5):
             logger.log(5, 'Set %s to %s', name, value)
 
     def __hash__(self):
@@ -155,21 +164,57 @@ class HypertextGenerationEnvironment(dict):
         * :py:class:`bs4.BeautifulSoup`: Writes the prettified version of the BeautifulSoup parsed HTML to the page. If a tag is used, the tag enclosing happens at the abstract level to keep the HTML syntax valid.
         * :py:class:`pyhgss.environment.HypertextGenerationEnvironment.JSCode`: Writes the JavaScript enclosed in <script> tags to the page.
         '''
+        # bs4 is only imported when the script uses it, so BeautifulSoup can't be registered as a type
+        bs4 = sys.modules.get('bs4')
+        if bs4 is not None and isinstance(data, bs4.BeautifulSoup):
+            return self._write_html(data, tag)
         # default method stringifies argument
         self.write(str(data), tag)
 
     @write.register
     def _write(self, string: str, tag: str = None):
-        self.logger.debug('Write string %s', string)
-        self.data += bytes(string, encoding=self.file_encoding)
+        if logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Write string %s', string)
+        self.chunks.append(bytes(string, encoding=self.file_encoding))
 
     @write.register
-    def _write(self, html: bs4.BeautifulSoup, tag: str = None):
-        self.logger.debug('Write HTML %s', html)
+    def _write(self, chunk: ConstantChunk, tag: str = None):
+        if logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Write constant %s', chunk)
+        if chunk.filename is not None:
+            self.loaded_files.append(chunk.filename)
+        self.chunks.append(chunk.encoded(self.file_encoding))
+
+    def _write_html(self, html, tag: str = None):
+        if logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Write HTML %s', html)
         if tag is not None:
             html = html.wrap(html.new_tag(tag))
-        self.data += bytes(self.__selected_autoformatter(html),
-                           encoding=self.file_encoding)
+        self.chunks.append(bytes(self.__selected_autoformatter(html),
+                                 encoding=self.file_encoding))
+
+    async def write_async(self, data, tag: str = None):
+        '''
+        Asynchronous variant of :py:meth:`write` for scripts that use top-level ``await``. If the data is awaitable, it is awaited first. Pass tasks to fetch several pieces of data concurrently while still writing them in order; the tasks already run while the first one is awaited::
+
+            header = asyncio.create_task(fetch(header_url))
+            body = asyncio.create_task(fetch(body_url))
+            await write_async(header)
+            await write_async(body)
+
+        Note that a plain coroutine like ``fetch(body_url)`` only starts running when it is awaited, so writing two coroutines one after another takes as long as both calls together.
+        '''
+        import inspect
+        if inspect.isawaitable(data):
+            data = await data
+        self.write(data, tag)
+
+    async def load_async(self, filename: str, type_: Type = None):
+        '''
+        Asynchronous variant of :py:meth:`load` for scripts that use top-level ``await``. The file is read in a separate thread, so that other awaited operations of the script can continue meanwhile.
+        '''
+        import asyncio
+        return await asyncio.to_thread(self.load, filename, type_)
 
     def load(self, filename: str, type_: Type = None):
         '''
@@ -193,12 +238,14 @@ class HypertextGenerationEnvironment(dict):
         encoding = guess_encoding(filename)
         self.logger.debug(
             'Loading file %s, guessed encoding %s', filename, encoding)
+        self.loaded_files.append(filename)
 
         with open(filename, 'r', encoding=encoding) as file:
             contents = file.read()
 
         match type_:
             case Type.HTML:
+                import bs4
                 output = bs4.BeautifulSoup(contents)
             case Type.JavaScript:
                 output = HypertextGenerationEnvironment.JSCode(contents)
@@ -207,6 +254,31 @@ class HypertextGenerationEnvironment(dict):
 
         return output
 
+    def cache_fragment(self, key, ttl=None):
+        '''
+        Cache the output of a part of the script, so that it is only generated once in a while instead of for every request.
+
+        The cache is shared by all scripts, so a fragment that is used on several pages (e.g. a sidebar) can be generated by any of them. Only the written data is cached; headers are not. Can be used in two ways:
+
+        * As a context manager. Entering it writes the cached fragment, if any, and returns True; the enclosed code should then skip generating the fragment::
+
+            with cache_fragment('sidebar', 60) as cached:
+                if not cached:
+                    write(expensive_sidebar())
+
+        * As a function decorator. The function is only called if no cached fragment was written, in which case it returns None::
+
+            @cache_fragment('navigation', 300)
+            def navigation():
+                write(...)
+
+            navigation()
+
+        :param key: The fragment's cache key, any hashable object.
+        :param ttl: The time in seconds after which the fragment is generated again. None (the default) keeps the fragment until the cache is full, ``never`` disables caching. In any case, the fragment is generated again once a file that was loaded for it changes.
+        '''
+        return FragmentCapture(self, key, ttl, self.fragment_cache)
+
     def header(self, key: str, value: str):
         '''
         Set an HTTP header. Any existing header with this name is overwritten.
@@ -228,6 +300,8 @@ class HypertextGenerationEnvironment(dict):
         match setting_name:
             case 'encoding':
                 self.file_encoding = str(value)
+            case 'cache':
+                self.cache_time = value
             case 'autoformat':
                 if bool(value):
                     self.__selected_autoformatter = lambda html: html.prettify()
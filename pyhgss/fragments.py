@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+if __name__ == 'fragments' or __name__ == '__main__':
+    from dependencies import changed_files
+    from util import stat_signature
+else:
+    from .dependencies import changed_files
+    from .util import stat_signature
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCache(object):
+    '''
+    A bounded, thread-safe cache of encoded page fragments, shared by all scripts.
+
+    Fragments expire after their time to live, or as soon as a file that was loaded while generating them changes. The least recently used fragments are evicted once the total size of all fragments exceeds the maximum size.
+    '''
+
+    def __init__(self, max_size: int = 16 * 1024 * 1024):
+        ''':param max_size: The maximum number of bytes of all fragments together.'''
+        self.max_size = max_size
+        self._size = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Return the tuple (data, loaded files) of a cached fragment, or None if there is no valid fragment for the key.'''
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is None:
+                return None
+            data, dependencies, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._fragments.move_to_end(key)
+        # check the files outside of the lock, stat calls may be slow
+        changed = changed_files(dependencies)
+        if changed:
+            logger.debug('Fragment %s is stale, %s changed', key, ', '.join(changed))
+            with self._lock:
+                if self._fragments.get(key) is entry:
+                    self._remove(key)
+            return None
+        return data, tuple(dependencies)
+
+    def put(self, key, data: bytes, loaded_files: list, ttl=None):
+        '''
+        Store a fragment.
+
+        :param data: The encoded fragment.
+        :param loaded_files: The files that were loaded while the fragment was generated.
+        :param ttl: The time in seconds after which the fragment expires, or None if it only expires when evicted.
+        '''
+        if len(data) > self.max_size:
+            logger.debug('Fragment %s with %d bytes is too large to cache', key, len(data))
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        dependencies = {filename: stat_signature(filename) for filename in loaded_files}
+        with self._lock:
+            self._remove(key)
+            self._fragments[key] = (data, dependencies, expires)
+            self._size += len(data)
+            while self._size > self.max_size:
+                self._remove(next(iter(self._fragments)))
+
+    def clear(self):
+        '''Remove all fragments.'''
+        with self._lock:
+            self._fragments.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        entry = self._fragments.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+
+# the cache that all environments use unless they are given another one
+default_fragment_cache = FragmentCache()
+
+
+class FragmentCapture(object):
+    '''
+    Captures the output of a part of a PyHG script for the fragment cache, or writes the cached output instead. Returned by ``cache_fragment()``.
+
+    Used as a context manager, entering it writes the cached fragment if there is one and returns whether it did; the body should then skip generating the fragment. Used as a function decorator, the function is only called if there is no cached fragment.
+    '''
+
+    def __init__(self, environment, key, ttl, cache: FragmentCache):
+        self.environment = environment
+        self.key = key
+        self.ttl = ttl
+        self.cache = cache
+        self._start = None
+
+    def _cache_key(self):
+        # the cached bytes are only valid for the encoding they were written in
+        return (self.key, self.environment.file_encoding)
+
+    def __enter__(self) -> bool:
+        if self.ttl != self.environment.never:
+            fragment = self.cache.get(self._cache_key())
+            if fragment is not None:
+                data, loaded_files = fragment
+                self.environment.logger.debug('Using cached fragment %s', self.key)
+                self.environment.chunks.append(data)
+                self.environment.loaded_files.extend(loaded_files)
+                self._start = None
+                return True
+        self._start = (len(self.environment.chunks),
+                       len(self.environment.loaded_files), self._cache_key())
+        return False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start is None or exc_type is not None or self.ttl == self.environment.never:
+            return False
+        chunk_start, file_start, key = self._start
+        self.cache.put(key, b''.join(self.environment.chunks[chunk_start:]),
+                       self.environment.loaded_files[file_start:], self.ttl)
+        self.environment.logger.debug('Cached fragment %s', self.key)
+        return False
+
+    def __call__(self, function):
+        def cached_function(*args, **kwargs):
+            capture = FragmentCapture(self.environment, self.key, self.ttl, self.cache)
+            with capture as cached:
+                if not cached:
+                    return function(*args, **kwargs)
+        cached_function.__name__ = function.__name__
+        cached_function.__doc__ = function.__doc__
+        return cached_function
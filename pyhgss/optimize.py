@@ -0,0 +1,146 @@
+import ast
+import logging
+import threading
+from pathlib import Path
+
+if __name__ == 'optimize' or __name__ == '__main__':
+    from util import guess_encoding, stat_signature
+else:
+    from .util import guess_encoding, stat_signature
+
+logger = logging.getLogger(__name__)
+
+# name under which the constant chunks of a script are made available to its environment
+CHUNKS_NAME = '__pyhgss_chunks__'
+
+
+class ConstantChunk(object):
+    '''
+    A piece of output that is known at compile time, either a string literal or the contents of a file that is loaded with ``load()``.
+
+    The chunk is encoded once per output encoding and the encoded bytes are reused for every execution. File chunks check the file's stat signature on every use and are re-read if the file changed.
+    '''
+
+    def __init__(self, text: str = None, filename: str = None):
+        '''
+        :param text: The constant text of this chunk.
+        :param filename: The absolute path of the file whose text content makes up this chunk. Exactly one of ``text`` and ``filename`` must be given.
+        '''
+        if (text is None) == (filename is None):
+            raise ValueError('exactly one of text and filename must be given')
+        self.text = text
+        self.filename = filename
+        self._signature = None
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        '''Return the chunk's text encoded with the given encoding, re-reading the underlying file if necessary.'''
+        if self.filename is not None:
+            signature = stat_signature(self.filename)
+            if signature is None or signature != self._signature:
+                self._reload(signature)
+        try:
+            return self._encoded[encoding]
+        except KeyError:
+            pass
+        with self._lock:
+            encoded = bytes(self.text, encoding=encoding)
+            self._encoded[encoding] = encoded
+        return encoded
+
+    def _reload(self, signature):
+        with self._lock:
+            logger.debug('(Re)loading constant chunk from %s', self.filename)
+            # this mirrors HypertextGenerationEnvironment.load()
+            with open(self.filename, 'r', encoding=guess_encoding(self.filename)) as file:
+                self.text = file.read()
+            self._encoded = {}
+            self._signature = signature
+
+    def __repr__(self):
+        return '<ConstantChunk %s>' % (self.filename if self.filename is not None else repr(self.text[:20]))
+
+
+class ConstantWriteTransformer(ast.NodeTransformer):
+    '''
+    AST transformer that replaces ``write()`` calls with constant string or ``load()``ed file arguments by writes of :py:class:`ConstantChunk` objects.
+
+    The chunks are collected in :py:attr:`chunks`; the transformed code looks them up by index in the global ``__pyhgss_chunks__``.
+    '''
+
+    def __init__(self, script_name: str, optimize_loads: bool = True):
+        '''
+        :param script_name: The file name of the script, used for resolving ``load()`` arguments.
+        :param optimize_loads: Whether ``write(load(...))`` may be optimized. This should be False if the script rebinds ``load``.
+        '''
+        self.script_directory = Path(script_name).parent
+        self.optimize_loads = optimize_loads
+        self.chunks = []
+
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        if not (isinstance(node.func, ast.Name) and node.func.id == 'write'
+                and len(node.args) == 1 and not node.keywords):
+            return node
+        chunk = self.chunk_for(node.args[0])
+        if chunk is None:
+            return node
+        self.chunks.append(chunk)
+        lookup = ast.Subscript(value=ast.Name(id=CHUNKS_NAME, ctx=ast.Load()),
+                               slice=ast.Constant(value=len(self.chunks) - 1),
+                               ctx=ast.Load())
+        node.args[0] = ast.copy_location(lookup, node.args[0])
+        return node
+
+    def chunk_for(self, argument: ast.expr) -> ConstantChunk:
+        '''Return a constant chunk for the given write() argument, or None if the argument is not constant.'''
+        if isinstance(argument, ast.Constant) and isinstance(argument.value, str):
+            return ConstantChunk(text=argument.value)
+        if (self.optimize_loads and isinstance(argument, ast.Call)
+                and isinstance(argument.func, ast.Name) and argument.func.id == 'load'
+                and len(argument.args) == 1 and not argument.keywords
+                and isinstance(argument.args[0], ast.Constant) and isinstance(argument.args[0].value, str)):
+            filename = str(self.script_directory.joinpath(
+                argument.args[0].value).absolute())
+            # missing files must fail at run time just as they would with load()
+            if Path(filename).is_file():
+                return ConstantChunk(filename=filename)
+        return None
+
+
+def bound_names(tree: ast.AST) -> set:
+    '''Return all names that are bound anywhere in the given syntax tree.'''
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split('.')[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+    return names
+
+
+def optimize_constant_writes(tree: ast.Module, script_name: str):
+    '''
+    Pre-compute constant output of a parsed PyHG script.
+
+    :param tree: The parsed script module. It is modified in place.
+    :param script_name: The file name of the script.
+    :returns: The tuple (transformed tree, list of constant chunks).
+    '''
+    names = bound_names(tree)
+    if 'write' in names or CHUNKS_NAME in names:
+        # the script defines its own write, we can't know what it does
+        return tree, []
+    transformer = ConstantWriteTransformer(
+        script_name, optimize_loads='load' not in names)
+    tree = ast.fix_missing_locations(transformer.visit(tree))
+    logger.debug('Found %d constant chunks in %s',
+                 len(transformer.chunks), script_name)
+    return tree, transformer.chunks
@@ -14,51 +14,160 @@ else:
     from . import HypertextGenerator, make_environment
 
 
+def is_legal_static_file(filename: str, toserve: str) -> bool:
+    '''
+    Checks whether a given file is a legal non-script static file under the given serving rules.
+
+    :param toserve: None (no static files), 'html' (only HTML files) or 'all' (all non-script files).
+    '''
+    if toserve == None:
+        return False
+    if toserve == 'html':
+        return filename.endswith('.html')
+    elif toserve == 'all':
+        return not any((filename.endswith(ending) for ending in HypertextGenerator.SUPPORTED_ENDINGS))
+    else:
+        return False
+
+
+def find_script(directory: str, path: str, toserve: str) -> str:
+    '''
+    Find the PyHG script that serves the given normalized URL path inside the given directory.
+
+    The path is tried with all supported script endings and without any ending. Files that are legal static files under the serving rules are not scripts.
+
+    :returns: The absolute file name of the script, or None if no script serves the path.
+    '''
+    found = None
+    fullpath = pathtools.abspath(directory + path)
+    for ending in HypertextGenerator.SUPPORTED_ENDINGS + ('',):
+        scriptfile = fullpath + ending
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('try %s', scriptfile)
+        if (pathtools.exists(scriptfile)
+            and not pathtools.isdir(scriptfile)
+                and not is_legal_static_file(scriptfile, toserve)):
+            found = scriptfile
+    return found
+
+
+_excepthook_installed = False
+
+
+def install_excepthook():
+    '''Feed exception output through the stackprinter module. This only does work on the first call, so it can be called for every request.'''
+    global _excepthook_installed
+    if _excepthook_installed:
+        return
+    import stackprinter
+    stackprinter.set_excepthook(style="darkbg")
+    _excepthook_installed = True
+
+
+class _CountingWriter(object):
+    '''Wraps a handler's output stream and counts the bytes that are written to it.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
 class LoggingBaseHTTPRequestHandler(BaseHTTPRequestHandler):
     '''
     Short extension of the BaseHTTPRequestHandler that redirects logging output
     to the logger provided as the first argument to the constructor.
 
     Also, exception output is fed through the stackprinter module.
+
+    :param access_log: A :py:class:`pyhgss.accesslog.AccessLog` that every
+        response is additionally logged to, optional. Responses are logged
+        to it once they are complete, with the size of the sent body.
     '''
 
-    def __init__(self, *arg, logger=logging.getLogger(__name__), **kwargs):
-        import stackprinter
+    def __init__(self, *arg, logger=logging.getLogger(__name__), access_log=None, **kwargs):
+        install_excepthook()
         self.last_logged_str = ''
         self.logger = logger
+        self.access_log = access_log
+        # (status code, body start) of the response that still has to go to the access log
+        self._access_pending = None
         super().__init__(*arg, **kwargs)
-        stackprinter.set_excepthook(style="darkbg")
+
+    def setup(self):
+        super().setup()
+        if self.access_log is not None:
+            self.wfile = _CountingWriter(self.wfile)
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            self._log_access()
+
+    def end_headers(self):
+        super().end_headers()
+        if self._access_pending is not None:
+            # everything that is written from now on is the body
+            self._access_pending = (self._access_pending[0], self.wfile.written)
+
+    def _log_access(self):
+        if self._access_pending is None:
+            return
+        code, body_start = self._access_pending
+        self._access_pending = None
+        size = self.wfile.written - body_start if body_start is not None else None
+        self.access_log.log(self.client_address[0], self.requestline, code, size)
+
+    def send_script(self, script):
+        '''Execute a PyHG script and send its output as the response.'''
+        headers, data = script.execute()
+        self.send_response(200)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
 
     def send_response_only(self, code, message=None):
         self.log_request(code, message if message is not None else '')
         super().send_response_only(code, message)
 
     def send_response(self, code, message=None):
-        # HACK: prevent send_response from logging by
-        # removing the logger methods temporarily
-        oldloggers = self.log_message, self.log_error, self.log_warning
-        self.log_message = lambda format, *args: None
-        self.log_warning = lambda format, *args: None
-        self.log_error = lambda format, *args: None
-        super().send_response(code, message)
-        self.log_message, self.log_error, self.log_warning = oldloggers
-        self.log_request(code, message if message is not None else '')
+        # same as BaseHTTPRequestHandler.send_response, except that the
+        # request is only logged once, by send_response_only
+        self.send_response_only(code, message)
+        self.send_header('Server', self.version_string())
+        self.send_header('Date', self.date_time_string())
 
     def log_message(self, string, *args):
-        self.logger.info(string % args)
+        self.logger.info(string, *args)
 
     def log_warning(self, string, *args):
-        self.logger.warning(string % args)
+        self.logger.warning(string, *args)
 
     def log_error(self, string, *args):
         if string.startswith('code '):
             # no extra logging of >= 300 requests
             return
-        self.logger.error(string % args)
+        self.logger.error(string, *args)
 
     def log_request(self, code=000, size=''):
         if isinstance(code, HTTPStatus):
             code = code.value
+        if self.access_log is not None:
+            # e.g. a 100 Continue before the actual response
+            self._log_access()
+            self._access_pending = (code, None)
+        level = (logging.WARNING if 400 > code >= 300 else
+                 logging.ERROR if code >= 400 else logging.INFO)
+        if not self.logger.isEnabledFor(level):
+            return
         fmtstring = f'%38s: %s - {self.statustype(code)} (%s)'
         if code >= 300 and code < 400:
             self.log_warning(fmtstring, self.requestline, str(code), str(size))
@@ -94,13 +203,21 @@ class HierarchicalPyghssHTTPRequestHandler(LoggingBaseHTTPRequestHandler, Simple
         to 'html', only if SimpleHTTPRequestHandler's send_head() sets a
         `Content-Type: text/html` header, the file will be served. This also
         means that directory listings are served.
+
+    :param worker_pool: A :py:class:`pyhgss.workers.ScriptWorkerPool` to execute
+        the scripts in, optional. By default, scripts are executed in the request's thread.
+
+    :param output_cache: A :py:class:`pyhgss.sharedcache.SharedCache` to cache the
+        scripts' output in, optional.
     '''
 
-    def __init__(self, *args, scriptdict=None, serve_arbitrary_files=True, **kwargs):
+    def __init__(self, *args, scriptdict=None, serve_arbitrary_files=True, worker_pool=None, output_cache=None, **kwargs):
         if scriptdict is None:
             # use a private scriptdict
             scriptdict = {}
         self.scriptdict = scriptdict
+        self.worker_pool = worker_pool
+        self.output_cache = output_cache
         self.toserve = (None if serve_arbitrary_files is False
                         else 'html' if serve_arbitrary_files == 'html'
                         else 'all')
@@ -119,7 +236,8 @@ class HierarchicalPyghssHTTPRequestHandler(LoggingBaseHTTPRequestHandler, Simple
         url = urllib.parse.urlparse(self.path)
 
         path = posixpath.normpath(url.path)
-        self.logger.debug(path)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(path)
 
         # find the hypertext generating script
         hgs = None
@@ -127,26 +245,17 @@ class HierarchicalPyghssHTTPRequestHandler(LoggingBaseHTTPRequestHandler, Simple
             # if it already exists, use it
             hgs = self.scriptdict[path]
         else:
-            fullpath = pathtools.abspath(self.directory + path)
-            for ending in HypertextGenerator.SUPPORTED_ENDINGS + ('',):
-                scriptfile = fullpath + ending
-                logger.debug('try %s', scriptfile)
-                if (pathtools.exists(scriptfile)
-                    and not pathtools.isdir(scriptfile)
-                        and not self.is_legal_static_file(scriptfile)):
-                    hgs = HypertextGenerator(scriptfile)
-                    self.scriptdict[path] = hgs
+            scriptfile = find_script(self.directory, path, self.toserve)
+            if scriptfile is not None:
+                hgs = HypertextGenerator(scriptfile, worker_pool=self.worker_pool,
+                                         output_cache=self.output_cache)
+                self.scriptdict[path] = hgs
 
         if hgs is not None:
             # we have ourselves a script
             self.logger.info('Executing PyHG Script %s', path)
             # TODO override options?
-            headers, data = hgs.execute()
-            self.send_response(200)
-            for header, value in headers.items():
-                self.send_header(header, value)
-            self.end_headers()
-            self.wfile.write(data)
+            self.send_script(hgs)
             return
         # if that fails, dispatch to simplehttp if required, check mime header if necessary
         if self.toserve is None:
@@ -169,16 +278,9 @@ class HierarchicalPyghssHTTPRequestHandler(LoggingBaseHTTPRequestHandler, Simple
                 self._headers_buffer = []
                 self.send_error(404)
 
-    def is_legal_static_file(self, scriptfile: bool):
+    def is_legal_static_file(self, scriptfile: str):
         '''Checks whether a given script file is a legal non-script static file under this request handler's serving rules.'''
-        if self.toserve == None:
-            return False
-        if self.toserve == 'html':
-            return scriptfile.endswith('.html')
-        elif self.toserve == 'all':
-            return not any((scriptfile.endswith(ending) for ending in HypertextGenerator.SUPPORTED_ENDINGS))
-        else:
-            return False
+        return is_legal_static_file(scriptfile, self.toserve)
 
 
 class SinglePyghssHTTPRequestHandler(LoggingBaseHTTPRequestHandler):
@@ -224,8 +326,7 @@ class SinglePyghssHTTPRequestHandler(LoggingBaseHTTPRequestHandler):
 
     def execute_request(self, methodstr: str):
         self.logger.info('%s request on %s', methodstr, self.filename)
-        binary = self.script.execute()
-        self.wfile.write(binary)
+        self.send_script(self.script)
 
 
 class MultiplePyhgssHTTPRequestHandler(LoggingBaseHTTPRequestHandler):
@@ -234,13 +335,14 @@ class MultiplePyhgssHTTPRequestHandler(LoggingBaseHTTPRequestHandler):
     corresponding path, and sends 404 for all other paths.
     '''
 
-    def __init__(self, *args, files=None, scriptdict={}, **kwargs):
+    def __init__(self, *args, files=None, scriptdict={}, worker_pool=None, output_cache=None, **kwargs):
         if files is None:
             raise ValueError('files must not be None')
         self.files = files
         self.scripts = scriptdict
         for file in self.files:
-            self.scripts[file] = HypertextGenerator(file)
+            self.scripts[file] = HypertextGenerator(file, worker_pool=worker_pool,
+                                                    output_cache=output_cache)
         super().__init__(*args, **kwargs)
 
     # all da http
@@ -275,5 +377,4 @@ class MultiplePyhgssHTTPRequestHandler(LoggingBaseHTTPRequestHandler):
         logger.info('%s %s request on scripts %s',
                     methodstr, self.path, self.files)
         path = posixpath.normpath(urllib.parse.urlparse(self.path).path)
-        binary = self.scripts[path].execute()
-        self.wfile.write(binary)
+        self.send_script(self.scripts[path])
@@ -0,0 +1,190 @@
+import logging
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import sha1
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking on this platform
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCache(object):
+    '''
+    A key-value cache in a memory-mapped file that can be shared by several server processes.
+
+    The file is divided into fixed-size slots, which are grouped into buckets. A key is hashed to select its bucket, and once a bucket is full, its least recently used slot is overwritten. Values can be any object that :py:mod:`marshal` supports; values that don't fit into a slot are not cached. All operations lock the file, so the cache is safe to use from several threads and processes.
+
+    .. note:: On platforms without :py:mod:`fcntl` (i.e. Windows), only threads in the same process are synchronized.
+    '''
+
+    MAGIC = b'PYHGSSC1'
+    # magic, slot size, slots per bucket, bucket count
+    FILE_HEADER = struct.Struct('<8sIII')
+    # key digest, expiry time (0 for never), last use time, value length
+    SLOT_HEADER = struct.Struct('<20sddI')
+
+    def __init__(self, filename: str, size: int = 64 * 1024 * 1024, slot_size: int = 64 * 1024, ways: int = 8):
+        '''
+        :param filename: The cache file, which is created if it doesn't exist. Existing files that are neither empty nor a cache are refused with :py:exc:`ValueError`. All processes that use the same file share the cache. If the file already is a cache, its size parameters are used instead of the given ones.
+        :param size: The approximate size of the cache file in bytes.
+        :param slot_size: The size of a single slot in bytes, which limits the size of cached values.
+        :param ways: The number of slots per bucket.
+        '''
+        self.filename = filename
+        self.slot_size = slot_size
+        self.ways = ways
+        self.buckets = max(1, (size - self.FILE_HEADER.size) // (slot_size * ways))
+        self.size = self.FILE_HEADER.size + self.buckets * ways * slot_size
+        self._thread_lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self._file = open(os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600), 'r+b')
+        with self._locked():
+            self._file.seek(0)
+            stored = self._file.read(self.FILE_HEADER.size)
+            if stored.startswith(self.MAGIC):
+                self._attach(stored)
+            elif not stored:
+                self._initialize()
+            else:
+                # never overwrite a file that isn't ours, e.g. because of a mistyped path
+                raise ValueError(f'{self.filename} is not a shared cache file')
+            self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    def _initialize(self):
+        # only called for empty files, so no process has them mapped
+        logger.info('Initializing shared cache %s with %d slots',
+                    self.filename, self.buckets * self.ways)
+        self._file.truncate(self.size)
+        self._file.seek(0)
+        self._file.write(self.FILE_HEADER.pack(
+            self.MAGIC, self.slot_size, self.ways, self.buckets))
+        self._file.flush()
+
+    def _attach(self, stored: bytes):
+        if len(stored) < self.FILE_HEADER.size:
+            raise ValueError(f'{self.filename} is a damaged shared cache file')
+        _, slot_size, ways, buckets = self.FILE_HEADER.unpack(stored)
+        if (slot_size, ways, buckets) != (self.slot_size, self.ways, self.buckets):
+            # another process created the cache with different parameters; a live cache is never resized
+            logger.warning('Shared cache %s has %d slots of %d bytes, using these instead of the requested size',
+                           self.filename, buckets * ways, slot_size)
+            self.slot_size, self.ways, self.buckets = slot_size, ways, buckets
+            self.size = self.FILE_HEADER.size + buckets * ways * slot_size
+        if os.path.getsize(self.filename) < self.size:
+            raise ValueError(f'{self.filename} is a damaged shared cache file')
+
+    def __getstate__(self):
+        # the memory map can't be pickled, worker processes open the file again
+        return {'filename': self.filename, 'slot_size': self.slot_size, 'ways': self.ways,
+                'buckets': self.buckets, 'size': self.size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._thread_lock = threading.Lock()
+        self._open()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is not None:
+                fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _slots(self, digest: bytes):
+        bucket = int.from_bytes(digest[:8], 'little') % self.buckets
+        start = self.FILE_HEADER.size + bucket * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size, self.slot_size)
+
+    @staticmethod
+    def _digest(key) -> bytes:
+        return sha1(repr(key).encode('utf-8')).digest()
+
+    def get(self, key):
+        '''Return the cached value for the key, or None if there is no valid value.'''
+        digest = self._digest(key)
+        now = time.time()
+        with self._locked():
+            for offset in self._slots(digest):
+                slot_digest, expires, _, length = self.SLOT_HEADER.unpack_from(
+                    self._map, offset)
+                if slot_digest != digest:
+                    continue
+                if expires != 0 and expires <= now:
+                    self._map[offset:offset + self.SLOT_HEADER.size] = bytes(self.SLOT_HEADER.size)
+                    return None
+                self.SLOT_HEADER.pack_into(
+                    self._map, offset, digest, expires, now, length)
+                start = offset + self.SLOT_HEADER.size
+                payload = self._map[start:start + length]
+                break
+            else:
+                return None
+        try:
+            return marshal.loads(payload)
+        except (ValueError, EOFError, TypeError):
+            logger.warning('Corrupted shared cache entry for %s', key)
+            return None
+
+    def put(self, key, value, ttl=None) -> bool:
+        '''
+        Store a value.
+
+        :param ttl: The time in seconds after which the value expires, or None if it only expires when it is evicted.
+        :returns: Whether the value was stored; values that are too large for a slot are not.
+        '''
+        payload = marshal.dumps(value)
+        if len(payload) > self.slot_size - self.SLOT_HEADER.size:
+            logger.debug('Value for %s with %d bytes is too large for the shared cache',
+                         key, len(payload))
+            return False
+        digest = self._digest(key)
+        now = time.time()
+        expires = now + ttl if ttl is not None else 0
+        with self._locked():
+            # prefer the key's own slot, so that a key is never stored twice,
+            # then a free or expired slot, then the least recently used one
+            same = free = lru = None
+            oldest = None
+            for offset in self._slots(digest):
+                slot_digest, slot_expires, last_used, _ = self.SLOT_HEADER.unpack_from(
+                    self._map, offset)
+                if slot_digest == digest:
+                    same = offset
+                    break
+                if free is None and (slot_digest == bytes(20) or (slot_expires != 0 and slot_expires <= now)):
+                    free = offset
+                if oldest is None or last_used < oldest:
+                    oldest = last_used
+                    lru = offset
+            target = next(offset for offset in (same, free, lru) if offset is not None)
+            start = target + self.SLOT_HEADER.size
+            self._map[start:start + len(payload)] = payload
+            self.SLOT_HEADER.pack_into(
+                self._map, target, digest, expires, now, len(payload))
+        return True
+
+    def clear(self):
+        '''Remove all values.'''
+        with self._locked():
+            for offset in range(self.FILE_HEADER.size, self.size, self.slot_size):
+                self._map[offset:offset + self.SLOT_HEADER.size] = bytes(self.SLOT_HEADER.size)
+
+    def close(self):
+        '''Close the cache file. The cache can't be used afterwards.'''
+        self._map.close()
+        self._file.close()
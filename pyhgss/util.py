@@ -1,11 +1,41 @@
+import os
 
-from chardet.universaldetector import UniversalDetector
+
+# cache of detected encodings, see use_encoding_cache()
+_encoding_cache = None
+
+
+def use_encoding_cache(cache):
+    '''
+    Cache the encodings detected by :py:func:`guess_encoding` in the given cache, e.g. a :py:class:`pyhgss.sharedcache.SharedCache`. Entries are keyed by the file name and its stat signature, so they are invalidated when the file changes.
+
+    :param cache: An object with ``get(key)`` and ``put(key, value)`` methods, or None to disable caching.
+    '''
+    global _encoding_cache
+    _encoding_cache = cache
 
 
 def guess_encoding(filename: str) -> str:
     '''
     Guesses the file's encoding by using an incremental universal detector from chardet.
+    If an encoding cache is in use, the result of a previous detection is used as long as the file didn't change.
     '''
+    cache = _encoding_cache
+    if cache is not None:
+        key = ('encoding', os.path.abspath(filename), stat_signature(filename))
+        encoding = cache.get(key)
+        if encoding is not None:
+            return encoding
+        encoding = _detect_encoding(filename)
+        if encoding is not None:
+            cache.put(key, encoding)
+        return encoding
+    return _detect_encoding(filename)
+
+
+def _detect_encoding(filename: str) -> str:
+    # chardet is slow to import, only do it once it's needed
+    from chardet.universaldetector import UniversalDetector
     detector = UniversalDetector()
     with open(filename, 'rb') as file:
         for line in file:
@@ -14,3 +44,15 @@ def guess_encoding(filename: str) -> str:
                 break
     detector.close()
     return detector.result['encoding']
+
+
+def stat_signature(filename: str) -> tuple:
+    '''
+    Returns a cheap signature of the file's current state (modification time and size), or None if the file does not exist.
+    Two equal signatures mean that the file very likely was not changed in between.
+    '''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
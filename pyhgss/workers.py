@@ -0,0 +1,172 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+
+if __name__ == 'workers' or __name__ == '__main__':
+    from __init__ import HypertextGenerator
+    from util import use_encoding_cache
+else:
+    from . import HypertextGenerator
+    from .util import use_encoding_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ScriptWorkerError(Exception):
+    '''Signals that a PyHG script failed or crashed in a worker process.'''
+    pass
+
+
+def current_rss() -> int:
+    '''Return the resident set size of this process in bytes, or None if it can't be determined. Outside of Linux, this is the peak resident set size.'''
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+def worker_main(connection, encoding_cache=None):
+    '''
+    Main function of a worker process. Receives script file names over the connection, executes the scripts and sends back the results.
+
+    The scripts' compiled code is kept for the lifetime of the worker. The worker exits when it receives None or the connection is closed.
+
+    :param encoding_cache: A cache for detected file encodings that is shared with the other processes, optional.
+    '''
+    if encoding_cache is not None:
+        use_encoding_cache(encoding_cache)
+    generators = {}
+    while True:
+        try:
+            filename = connection.recv()
+        except EOFError:
+            break
+        if filename is None:
+            break
+        try:
+            generator = generators.get(filename)
+            if generator is None:
+                generator = generators[filename] = HypertextGenerator(filename)
+            environment = generator.run()
+            connection.send((True, environment.headers, b''.join(environment.chunks),
+                             environment.dependencies, HypertextGenerator.cache_ttl(environment.cache_time),
+                             current_rss()))
+        except Exception:
+            connection.send((False, traceback.format_exc(), None, None, None, current_rss()))
+    connection.close()
+
+
+class _Worker(object):
+    '''A single worker process and the parent's end of its connection.'''
+
+    def __init__(self, context, encoding_cache):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_connection, encoding_cache),
+                                       daemon=True, name='pyhgss-worker')
+        self.process.start()
+        child_connection.close()
+        self.requests = 0
+        self.rss = None
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+class ScriptWorkerPool(object):
+    '''
+    A pool of warm worker processes that execute PyHG scripts in isolation from the server process.
+
+    Scripts that run in worker processes don't hold the server's GIL, so CPU-heavy scripts can use all processor cores, and a crashing or leaking script doesn't take down the server. Each worker keeps the compiled code of the scripts it executed. Workers are replaced after a number of requests or when they use too much memory.
+
+    Pass the pool to :py:class:`pyhgss.HypertextGenerator` to execute the generator's script in the pool.
+    '''
+
+    def __init__(self, processes: int = None, max_requests: int = 1000, max_rss: int = None, encoding_cache=None):
+        '''
+        :param processes: The number of worker processes, defaults to the number of processors.
+        :param max_requests: The number of requests after which a worker is replaced, or None to never replace workers because of it.
+        :param max_rss: The resident set size in bytes above which a worker is replaced, or None to never replace workers because of it.
+        :param encoding_cache: A :py:class:`pyhgss.sharedcache.SharedCache` for the workers to cache detected file encodings in, optional.
+        '''
+        self.processes = processes if processes is not None else os.cpu_count() or 1
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.encoding_cache = encoding_cache
+        # spawned workers don't inherit the server's threads and sockets
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(self.processes):
+            self._idle.put(_Worker(self._context, self.encoding_cache))
+        logger.info('Started %d script worker processes', self.processes)
+
+    def execute(self, filename: str):
+        '''
+        Execute a script in one of the workers. Blocks until a worker is available.
+
+        :returns: The tuple (headers, data, dependencies, cache time) of the script's output, the files it used and the time in seconds for which the output may be cached (or None).
+        :raises ScriptWorkerError: If the script raised an exception or the worker crashed.
+        '''
+        if self._closed:
+            raise ScriptWorkerError('worker pool is shut down')
+        worker = self._idle.get()
+        try:
+            worker.connection.send(filename)
+            success, headers, data, dependencies, cache_ttl, worker.rss = worker.connection.recv()
+        except (EOFError, OSError) as error:
+            logger.error('Worker %d crashed while executing %s', worker.process.pid, filename)
+            self._replace(worker)
+            raise ScriptWorkerError(f'worker crashed while executing {filename}') from error
+
+        worker.requests += 1
+        if self._closed:
+            worker.stop()
+        elif self._should_retire(worker):
+            threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+        else:
+            self._idle.put(worker)
+
+        if not success:
+            raise ScriptWorkerError(f'script {filename} failed:\n{headers}')
+        return headers, data, dependencies, cache_ttl
+
+    def _should_retire(self, worker) -> bool:
+        if self.max_requests is not None and worker.requests >= self.max_requests:
+            logger.debug('Retiring worker %d after %d requests',
+                         worker.process.pid, worker.requests)
+            return True
+        if self.max_rss is not None and worker.rss is not None and worker.rss > self.max_rss:
+            logger.debug('Retiring worker %d using %d bytes',
+                         worker.process.pid, worker.rss)
+            return True
+        return False
+
+    def _replace(self, worker):
+        worker.stop()
+        if not self._closed:
+            self._idle.put(_Worker(self._context, self.encoding_cache))
+
+    def shutdown(self):
+        '''Stop all idle workers. Workers that are currently busy are stopped once they are returned.'''
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
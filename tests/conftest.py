@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the package modules import each other by their top-level names when run from the package folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pyhgss'))
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from admission import AdmissionController
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met in time'
+        time.sleep(0.005)
+
+
+def test_admits_up_to_limit():
+    controller = AdmissionController(2, max_queue=0)
+    assert controller.acquire()
+    assert controller.acquire()
+    assert not controller.acquire()
+    controller.release()
+    assert controller.acquire()
+    metrics = controller.metrics()
+    assert metrics['active'] == 2
+    assert metrics['admitted'] == 3
+    assert metrics['shed_queue_full'] == 1
+
+
+def test_waiting_requests_are_admitted_in_order():
+    controller = AdmissionController(1, max_queue=3)
+    assert controller.acquire()
+    order = []
+
+    def request(number):
+        assert controller.acquire()
+        order.append(number)
+        controller.release()
+
+    threads = []
+    for number in range(3):
+        thread = threading.Thread(target=request, args=(number,))
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: controller.metrics()['queued'] == number + 1)
+    controller.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2]
+
+
+def test_sheds_when_queue_is_full():
+    controller = AdmissionController(1, max_queue=1)
+    assert controller.acquire()
+    waiter = threading.Thread(target=controller.acquire)
+    waiter.start()
+    wait_for(lambda: controller.metrics()['queued'] == 1)
+    assert not controller.acquire()
+    assert controller.metrics()['shed_queue_full'] == 1
+    controller.release()
+    waiter.join()
+
+
+def test_sheds_after_queue_timeout():
+    controller = AdmissionController(1, queue_timeout=0.05)
+    assert controller.acquire()
+    assert not controller.acquire()
+    metrics = controller.metrics()
+    assert metrics['shed_queue_timeout'] == 1
+    assert metrics['queued'] == 0
@@ -0,0 +1,41 @@
+import ast
+import os
+
+from dependencies import DependencyGraph, changed_files, imported_files
+from util import stat_signature
+
+
+def test_imports_are_followed_transitively(tmp_path, monkeypatch):
+    (tmp_path / 'deps_page_module.py').write_text('import deps_helper\n')
+    (tmp_path / 'deps_helper.py').write_text('X = 1\n')
+    package = tmp_path / 'deps_package'
+    package.mkdir()
+    (package / '__init__.py').write_text('from . import sub\n')
+    (package / 'sub.py').write_text('from .deep import Y\n')
+    (package / 'deep.py').write_text('Y = 2\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    tree = ast.parse('import json\nimport deps_page_module\nfrom deps_package import sub\n')
+    files = {os.path.relpath(filename, tmp_path) for filename in imported_files(tree)}
+    assert files == {'deps_page_module.py', 'deps_helper.py',
+                     os.path.join('deps_package', '__init__.py'),
+                     os.path.join('deps_package', 'sub.py'),
+                     os.path.join('deps_package', 'deep.py')}
+
+
+def test_changed_files(tmp_path):
+    filename = tmp_path / 'nav.html'
+    filename.write_text('<nav></nav>')
+    dependencies = {str(filename): stat_signature(str(filename))}
+    assert changed_files(dependencies) == []
+    filename.write_text('<nav>changed</nav>')
+    assert changed_files(dependencies) == [str(filename)]
+
+
+def test_graph_finds_dependents():
+    graph = DependencyGraph()
+    graph.record('/site/a.pyh', {'/site/a.pyh': (1, 1), '/site/nav.html': (1, 1)})
+    graph.record('/site/b.pyh', {'/site/b.pyh': (1, 1), '/site/nav.html': (1, 1)})
+    assert graph.dependents('/site/nav.html') == {'/site/a.pyh', '/site/b.pyh'}
+    graph.forget('/site/a.pyh')
+    assert graph.dependents('/site/nav.html') == {'/site/b.pyh'}
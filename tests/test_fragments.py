@@ -0,0 +1,46 @@
+import os
+import time
+
+from fragments import FragmentCache
+
+
+def touch_later(filename, content):
+    filename.write_text(content, encoding='utf-8')
+    stat = filename.stat()
+    # make sure the signature changes even on coarse file system timestamps
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_put_and_get():
+    cache = FragmentCache()
+    assert cache.get('sidebar') is None
+    cache.put('sidebar', b'<aside></aside>', [])
+    assert cache.get('sidebar') == (b'<aside></aside>', ())
+
+
+def test_expired_fragments_are_not_returned():
+    cache = FragmentCache()
+    cache.put('sidebar', b'<aside></aside>', [], ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('sidebar') is None
+
+
+def test_least_recently_used_fragment_is_evicted():
+    cache = FragmentCache(max_size=10)
+    cache.put('a', b'aaaa', [])
+    cache.put('b', b'bbbb', [])
+    assert cache.get('a') is not None
+    cache.put('c', b'cccc', [])
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_fragment_is_invalidated_when_loaded_file_changes(tmp_path):
+    navigation = tmp_path / 'nav.html'
+    navigation.write_text('<nav>one</nav>', encoding='utf-8')
+    cache = FragmentCache()
+    cache.put('nav', b'<nav>one</nav>', [str(navigation)])
+    assert cache.get('nav') == (b'<nav>one</nav>', (str(navigation),))
+    touch_later(navigation, '<nav>two</nav>')
+    assert cache.get('nav') is None
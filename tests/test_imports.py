@@ -0,0 +1,33 @@
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+PACKAGE_DIRECTORY = Path(__file__).resolve().parent.parent / 'pyhgss'
+
+# modules that are slow to import and only needed for some scripts or commands
+LAZY_MODULES = ('bs4', 'chardet', 'argparse', 'stackprinter', 'asyncio')
+
+# generous, so that slow machines pass; importing the package takes around 30 ms on a laptop
+IMPORT_TIME_BUDGET_MS = 500
+
+
+def test_import_does_not_load_lazy_modules():
+    result = subprocess.run(
+        [sys.executable, '-c',
+         f'import __init__, sys, json; print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))'],
+        cwd=PACKAGE_DIRECTORY, capture_output=True, text=True, check=True)
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+
+
+def test_import_time():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import __init__'],
+        cwd=PACKAGE_DIRECTORY, capture_output=True, text=True, check=True)
+    # lines look like "import time:       882 |      34980 | __init__", in microseconds
+    match = re.search(r'^import time:\s*\d+ \|\s*(\d+) \| __init__$', result.stderr, re.MULTILINE)
+    assert match is not None, 'no import time reported for the package'
+    cumulative_ms = int(match.group(1)) / 1000
+    print(f'importing pyhgss took {cumulative_ms:.1f} ms')
+    assert cumulative_ms < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,23 @@
+import os
+
+from optimize import ConstantChunk
+
+
+def test_text_chunk_is_encoded_per_encoding():
+    chunk = ConstantChunk(text='Grüße')
+    assert chunk.encoded('utf-8') == 'Grüße'.encode('utf-8')
+    assert chunk.encoded('latin-1') == 'Grüße'.encode('latin-1')
+    assert chunk.encoded('utf-8') is chunk.encoded('utf-8')
+
+
+def test_file_chunk_is_reloaded_when_file_changes(tmp_path):
+    filename = tmp_path / 'fragment.html'
+    filename.write_text('<p>first</p>', encoding='utf-8')
+    chunk = ConstantChunk(filename=str(filename))
+    assert chunk.encoded('utf-8') == b'<p>first</p>'
+
+    filename.write_text('<p>second version</p>', encoding='utf-8')
+    stat = filename.stat()
+    # make sure the signature changes even on coarse file system timestamps
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert chunk.encoded('utf-8') == b'<p>second version</p>'
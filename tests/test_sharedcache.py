@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from sharedcache import SharedCache
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+def small_cache(filename, **kwargs):
+    # a single bucket with two slots
+    return SharedCache(filename, size=SharedCache.FILE_HEADER.size + 2 * 256,
+                       slot_size=256, ways=2, **kwargs)
+
+
+def test_put_and_get(cache_file):
+    cache = SharedCache(cache_file, size=1024 * 1024)
+    assert cache.get('missing') is None
+    assert cache.put(('page', 'utf-8'), ({'Content-Type': 'text/html'}, b'<p>hi</p>'))
+    assert cache.get(('page', 'utf-8')) == ({'Content-Type': 'text/html'}, b'<p>hi</p>')
+    assert cache.put(('page', 'utf-8'), 'replaced')
+    assert cache.get(('page', 'utf-8')) == 'replaced'
+    cache.clear()
+    assert cache.get(('page', 'utf-8')) is None
+    cache.close()
+
+
+def test_too_large_values_are_not_stored(cache_file):
+    cache = small_cache(cache_file)
+    assert not cache.put('large', b'x' * 256)
+    assert cache.get('large') is None
+    cache.close()
+
+
+def test_expired_values_are_not_returned(cache_file):
+    cache = small_cache(cache_file)
+    cache.put('key', 'value', ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('key') is None
+    cache.close()
+
+
+def test_least_recently_used_value_is_evicted(cache_file):
+    cache = small_cache(cache_file)
+    cache.put('a', 1)
+    time.sleep(0.001)
+    cache.put('b', 2)
+    time.sleep(0.001)
+    assert cache.get('a') == 1
+    time.sleep(0.001)
+    cache.put('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    cache.close()
+
+
+def test_existing_cache_is_shared_with_its_geometry(cache_file):
+    first = SharedCache(cache_file, size=4 * 1024 * 1024)
+    first.put('key', 'value')
+    second = SharedCache(cache_file, size=1024 * 1024)
+    assert second.size == first.size
+    assert second.get('key') == 'value'
+    second.put('other', 'value')
+    assert first.get('other') == 'value'
+    first.close()
+    second.close()
+
+
+def test_key_is_not_stored_twice(cache_file):
+    cache = small_cache(cache_file)
+    cache.put('x', 'expiring', ttl=0.01)
+    cache.put('k', 'v1')
+    time.sleep(0.02)
+    # clears the expired slot in front of the key's slot
+    assert cache.get('x') is None
+    cache.put('k', 'v2', ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('k') is None
+    assert cache.get('k') is None
+    cache.close()
+
+
+def test_other_files_are_not_overwritten(tmp_path):
+    filename = tmp_path / 'data'
+    filename.write_bytes(b'precious user data')
+    with pytest.raises(ValueError):
+        SharedCache(str(filename))
+    assert filename.read_bytes() == b'precious user data'